@@ -1,8 +1,18 @@
-from fastapi import FastAPI, HTTPException, Query, Depends
-from sqlmodel import SQLModel, Field, create_engine, Session, select
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response
+from fastapi.responses import ORJSONResponse
+from sqlmodel import SQLModel, Field, Relationship, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy import Float, Index, cast, func, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex, DropIndex
 from typing import Optional, List
+from pydantic import TypeAdapter
 import os
+import hashlib
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 from datetime import datetime
 import uuid
 from enum import Enum
@@ -12,9 +22,70 @@ load_dotenv()
 
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")  # Default to SQLite
-engine = create_engine(DATABASE_URL, echo=True)
 
-app = FastAPI()
+# The engine is async, so URLs naming the sync drivers are switched to their async counterparts
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+def async_database_url(url: str):
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername))
+
+engine = create_async_engine(
+    async_database_url(DATABASE_URL),
+    echo=os.getenv("SQL_ECHO") == "1",  # SQL logging is opt-in, it is expensive on every query
+    pool_pre_ping=True,
+    pool_size=10,
+    max_overflow=5,
+)
+
+# Indexes created by older versions that are redundant or cost more than they save
+RETIRED_INDEXES = {
+    "task": ["ix_task_status"],
+    "pomodorosession": ["ix_pomodorosession_task_id"],
+}
+
+# create_all only creates missing tables, so add indexes that older versions of existing tables lack.
+# Every worker runs this at startup, hence IF [NOT] EXISTS on all DDL.
+def migrate_indexes(conn):
+    inspector = inspect(conn)
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {index["name"]: index for index in inspector.get_indexes(table.name)}
+        for name in RETIRED_INDEXES.get(table.name, []):
+            if name in existing:
+                conn.execute(DropIndex(Index(name), if_exists=True))
+        for index in table.indexes:
+            found = existing.get(index.name)
+            if found and bool(found["unique"]) == bool(index.unique):
+                continue
+            if index.unique:
+                columns = list(index.columns)
+                duplicates = conn.execute(
+                    select(*columns).group_by(*columns).having(func.count() > 1).limit(5)
+                ).all()
+                if duplicates:
+                    raise RuntimeError(
+                        f"Cannot create unique index '{index.name}': table '{table.name}' has duplicate values "
+                        f"{[tuple(row) for row in duplicates]}, remove them and restart"
+                    )
+            if found:
+                conn.execute(DropIndex(index, if_exists=True))
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create tables if they do not exist and bring existing ones up to date
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(migrate_indexes)
+    yield
+    await engine.dispose()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Enum for task status
 class TaskStatus(str, Enum):
@@ -23,110 +94,145 @@ class TaskStatus(str, Enum):
     FINISHED = "zakończone"
 
 class TaskBase(SQLModel):
-    title: str = Field(..., min_length=3, max_length=100)
+    title: str = Field(..., min_length=3, max_length=100, index=True, unique=True)
     description: Optional[str] = Field(None, max_length=300)
     status: TaskStatus = Field(default=TaskStatus.TO_DO)
 
 class Task(TaskBase, table=True):  # Database model
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex, primary_key=True)
+    # Both sides of the task <-> sessions relationship are lazy="raise": nothing reads them yet, and a future
+    # read must opt into selectinload() instead of issuing a query per row (or failing under AsyncSession).
+    # passive_deletes: deleting a task must not load its sessions to null out their task_id
+    sessions: List["PomodoroSession"] = Relationship(
+        back_populates="task", sa_relationship_kwargs={"lazy": "raise", "passive_deletes": True}
+    )
 
 class PomodoroSession(SQLModel, table=True):  # Database model for Pomodoro sessions
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
-    task_id: str = Field(index=True, foreign_key="task.id")
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex, primary_key=True)
+    task_id: str = Field(foreign_key="task.id")  # Indexed by the composite index below
     start_time: datetime
     end_time: datetime
     completed: bool = Field(default=False)
+    task: Optional[Task] = Relationship(back_populates="sessions", sa_relationship_kwargs={"lazy": "raise"})
 
-# Create tables if they do not exist
-SQLModel.metadata.create_all(engine)
+    __table_args__ = (Index("ix_pomodorosession_task_id_completed", "task_id", "completed"),)
+
+# Serializes task lists straight to JSON bytes using the Task schema
+task_list_adapter = TypeAdapter(List[Task])
+
+# Weak comparison (RFC 9110): a "W/" prefix is ignored and "*" matches any representation
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
 
 # Dependency to handle database session
-def get_db():
-    with Session(engine) as session:
+async def get_db():
+    # Rows are fully populated client-side, so there is nothing to reload after a commit
+    async with AsyncSession(engine, expire_on_commit=False) as session:
         yield session
 
 # Routes
 @app.post("/tasks", response_model=Task)
-def create_task(task_in: TaskBase, db: Session = Depends(get_db)):
-    existing_task = db.exec(select(Task).where(Task.title == task_in.title)).first()
-    if existing_task:
-        raise HTTPException(status_code=400, detail=f"Task '{task_in.title}' already exists")
-
-    new_task = Task(**task_in.dict())
+async def create_task(task_in: TaskBase, db: AsyncSession = Depends(get_db)):
+    new_task = Task(title=task_in.title, description=task_in.description, status=task_in.status)
     db.add(new_task)
-    db.commit()
-    db.refresh(new_task)
+    try:
+        await db.commit()
+    except IntegrityError:  # Title uniqueness is enforced by the database
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Task '{task_in.title}' already exists")
     return new_task
 
 @app.get("/tasks", response_model=List[Task])
-def get_tasks(status: Optional[TaskStatus] = Query(None, description="Filter tasks by status"), db: Session = Depends(get_db)):
+async def get_tasks(request: Request, status: Optional[TaskStatus] = Query(None, description="Filter tasks by status"), db: AsyncSession = Depends(get_db)):
     query = select(Task)
     if status:
         query = query.where(Task.status == status)
-    return db.exec(query).all()
+    tasks = (await db.exec(query)).all()
+    # Returning a raw Response skips response_model, so the adapter applies the same Task schema
+    body = task_list_adapter.dump_json(tasks)
+
+    # The ETag is derived from the body, so it stays valid across restarts, workers and other writers.
+    # A 304 still runs the query and serialization; it only saves sending the body.
+    etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 @app.get("/tasks/{task_id}", response_model=Task)
-def get_task(task_id: str, db: Session = Depends(get_db)):
-    task = db.exec(select(Task).where(Task.id == task_id)).first()
+async def get_task(task_id: str, db: AsyncSession = Depends(get_db)):
+    task = await db.get(Task, task_id)
     if not task:
         raise HTTPException(status_code=404, detail=f"Task with ID '{task_id}' does not exist")
     return task
 
 @app.put("/tasks/{task_id}", response_model=Task)
-def update_task(task_id: str, task_update: TaskBase, db: Session = Depends(get_db)):
-    task = db.exec(select(Task).where(Task.id == task_id)).first()
+async def update_task(task_id: str, task_update: TaskBase, db: AsyncSession = Depends(get_db)):
+    task = await db.get(Task, task_id)
     if not task:
         raise HTTPException(status_code=404, detail=f"Task with ID '{task_id}' does not exist")
 
-    for key, value in task_update.dict().items():
-        setattr(task, key, value)
-
-    db.add(task)
-    db.commit()
-    db.refresh(task)
+    task.sqlmodel_update(task_update.model_dump(exclude_unset=True))
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Task '{task_update.title}' already exists")
     return task
 
 @app.delete("/tasks/{task_id}", response_model=dict)
-def delete_task(task_id: str, db: Session = Depends(get_db)):
-    task = db.exec(select(Task).where(Task.id == task_id)).first()
+async def delete_task(task_id: str, db: AsyncSession = Depends(get_db)):
+    task = await db.get(Task, task_id)
     if not task:
         raise HTTPException(status_code=404, detail=f"Task with ID '{task_id}' does not exist")
 
-    db.delete(task)
-    db.commit()
+    await db.delete(task)
+    await db.commit()
     return {"message": f"Task with ID '{task_id}' has been deleted"}
 
 @app.post("/pomodoro", response_model=PomodoroSession)
-def create_pomodoro_session(task_id: str, start_time: datetime, end_time: datetime, db: Session = Depends(get_db)):
-    task = db.exec(select(Task).where(Task.id == task_id)).first()
+async def create_pomodoro_session(task_id: str, start_time: datetime, end_time: datetime, db: AsyncSession = Depends(get_db)):
+    task = await db.get(Task, task_id)
     if not task:
         raise HTTPException(status_code=404, detail=f"Task with ID '{task_id}' does not exist")
 
     session = PomodoroSession(task_id=task_id, start_time=start_time, end_time=end_time)
     db.add(session)
-    db.commit()
-    db.refresh(session)
+    await db.commit()
     return session
 
 @app.get("/pomodoro/stats", response_model=dict)
-def get_pomodoro_stats(db: Session = Depends(get_db)):
-    sessions = db.exec(select(PomodoroSession).where(PomodoroSession.completed == True)).all()
-    stats = {}
-    total_time = 0
-
-    for session in sessions:
-        task_id = session.task_id
-        session_time = (session.end_time - session.start_time).total_seconds() / 60
-
-        if task_id not in stats:
-            stats[task_id] = {"completed_sessions": 0, "total_time": 0}
-
-        stats[task_id]["completed_sessions"] += 1
-        stats[task_id]["total_time"] += session_time
-        total_time += session_time
+async def get_pomodoro_stats(db: AsyncSession = Depends(get_db)):
+    # Aggregate in the database so only one row per task is returned
+    if engine.dialect.name == "sqlite":
+        # strftime('%s') gives whole seconds; SQLAlchemy stores the ".ffffff" fraction from character 20
+        seconds = (
+            (func.strftime("%s", PomodoroSession.end_time) - func.strftime("%s", PomodoroSession.start_time))
+            + (func.substr(PomodoroSession.end_time, 20) - func.substr(PomodoroSession.start_time, 20))
+        )
+    else:
+        seconds = cast(func.extract("epoch", PomodoroSession.end_time - PomodoroSession.start_time), Float)
+
+    # Titles come from the same query; outer join keeps sessions of deleted tasks
+    rows = (await db.exec(
+        select(PomodoroSession.task_id, Task.title, func.count(), func.sum(seconds / 60.0))
+        .join(Task, Task.id == PomodoroSession.task_id, isouter=True)
+        .where(PomodoroSession.completed == True)
+        .group_by(PomodoroSession.task_id, Task.title)
+    )).all()
+
+    stats = {
+        task_id: {"title": title, "completed_sessions": completed_sessions, "total_time": total_time}
+        for task_id, title, completed_sessions, total_time in rows
+    }
+    total_time = sum(task_stats["total_time"] for task_stats in stats.values())
 
     return {"task_stats": stats, "total_time": total_time}
 
 @app.get("/pomodoro/sessions", response_model=List[PomodoroSession])
-def get_pomodoro_sessions(db: Session = Depends(get_db)):
-    return db.exec(select(PomodoroSession)).all()
+async def get_pomodoro_sessions(db: AsyncSession = Depends(get_db)):
+    return (await db.exec(select(PomodoroSession))).all()